@@ -232,6 +232,19 @@ class JobNotStartedError(JobError):
 class DependencyError(ReframeError):
     '''Raised when a dependency problem is encountered.'''
 
+    def __init__(self, *args, cycle=None):
+        super().__init__(*args)
+        self._cycle = tuple(cycle) if cycle is not None else None
+
+    @property
+    def cycle(self):
+        '''The names of the tests forming a cyclic dependency.
+
+        The first test is repeated at the end. This is :class:`None` if the
+        error is not due to a cyclic dependency.
+        '''
+        return self._cycle
+
 
 class ReframeDeprecationWarning(DeprecationWarning):
     '''Warning for deprecated features of the ReFrame framework.'''
@@ -8,7 +8,7 @@
 #
 
 import collections
-import itertools
+import heapq
 
 import reframe as rfm
 import reframe.utility as util
@@ -164,7 +164,8 @@ def validate_deps(graph):
                 if n in path:
                     cycle_str = '->'.join(path + [n])
                     raise DependencyError(
-                        'found cyclic dependency between tests: ' + cycle_str)
+                        'found cyclic dependency between tests: ' + cycle_str,
+                        cycle=path[path.index(n):] + [n])
 
                 if n not in visited:
                     unvisited.append((n, node))
@@ -181,42 +182,73 @@ def toposort(graph, is_subgraph=False):
     that any dangling edges will be ignored.
     '''
     test_deps = _reduce_deps(graph)
-    visited = util.OrderedSet()
 
-    def retrieve(d, key, default):
-        try:
-            return d[key]
-        except KeyError:
-            if is_subgraph:
-                return default
-            else:
-                raise
-
-    def visit(node, path):
-        # We assume an acyclic graph
-        assert node not in path
-
-        path.add(node)
-
-        # Do a DFS visit of all the adjacent nodes
-        for adj in retrieve(test_deps, node, []):
-            if adj not in visited:
-                visit(adj, path)
-
-        path.pop()
-        visited.add(node)
-
-    for r in test_deps.keys():
-        if r not in visited:
-            visit(r, util.OrderedSet())
-
-    # Index test cases by test name
-    cases_by_name = {}
-    for c in graph.keys():
-        try:
-            cases_by_name[c.check.name].append(c)
-        except KeyError:
-            cases_by_name[c.check.name] = [c]
+    # Count the dependencies of each test and index the tests depending on it
+    num_deps = {}
+    dependents = {}
+    for t, deps in test_deps.items():
+        num_deps[t] = 0
+        for d in deps:
+            if d not in test_deps:
+                if is_subgraph:
+                    # Dependency points outside the subgraph
+                    continue
+
+                raise KeyError(d)
+
+            num_deps[t] += 1
+            dependents.setdefault(d, []).append(t)
+
+    # Assign a level to each test, i.e., the length of the longest chain of
+    # dependencies starting from it, by visiting the tests in topological
+    # order with Kahn's algorithm
+    levels = dict.fromkeys(test_deps, 0)
+    ready = collections.deque(t for t, n in num_deps.items() if n == 0)
+    num_visited = 0
+    while ready:
+        t = ready.popleft()
+        num_visited += 1
+        for u in dependents.get(t, []):
+            levels[u] = max(levels[u], levels[t] + 1)
+            num_deps[u] -= 1
+            if num_deps[u] == 0:
+                ready.append(u)
+
+    # We assume an acyclic graph
+    assert num_visited == len(test_deps)
+
+    # Sort the test cases with Kahn's algorithm, always picking the ready
+    # case with the lowest (level, test, case) priority. The test and case
+    # priorities follow their order in the graph, so that the cases of each
+    # test are kept together and in their original partition and environment
+    # order.
+    test_index = {t: i for i, t in enumerate(test_deps)}
+    priority = {}
+    num_case_deps = {}
+    case_dependents = {}
+    ready_cases = []
+    for i, c in enumerate(graph):
+        cname = c.check.name
+        priority[c] = (levels[cname], test_index[cname], i)
+        num_case_deps[c] = 0
+        for d in graph[c]:
+            if d not in graph:
+                # Dependency points outside the subgraph
+                continue
+
+            num_case_deps[c] += 1
+            case_dependents.setdefault(d, []).append(c)
+
+        if num_case_deps[c] == 0:
+            heapq.heappush(ready_cases, (priority[c], c))
+
+    ret = []
+    while ready_cases:
+        _, c = heapq.heappop(ready_cases)
+        ret.append(c)
+        for u in case_dependents.get(c, []):
+            num_case_deps[u] -= 1
+            if num_case_deps[u] == 0:
+                heapq.heappush(ready_cases, (priority[u], u))
 
-    return list(itertools.chain(*(retrieve(cases_by_name, n, [])
-                                  for n in visited)))
+    return ret
@@ -44,9 +44,9 @@ class TestCase:
         return iter([self.__check, self.__partition, self.__environ])
 
     def __hash__(self):
-        return (hash(self.check.name) ^
-                hash(self.partition.fullname) ^
-                hash(self.environ.name))
+        return hash((self.check.name,
+                     self.partition.fullname,
+                     self.environ.name))
 
     def __eq__(self, other):
         if not isinstance(other, type(self)):
@@ -4,20 +4,19 @@
 # SPDX-License-Identifier: BSD-3-Clause
 
 import collections
+import concurrent.futures
+import copy
+import functools
 import itertools
 import os
 import pytest
 import time
-import tempfile
-import unittest
 
 import reframe as rfm
 import reframe.core.runtime as rt
 import reframe.frontend.dependency as dependency
 import reframe.frontend.executors as executors
 import reframe.frontend.executors.policies as policies
-import reframe.utility as util
-import reframe.utility.os_ext as os_ext
 from reframe.core.environments import Environment
 from reframe.core.exceptions import (
     DependencyError, JobNotStartedError,
@@ -25,36 +24,150 @@ from reframe.core.exceptions import (
 )
 from reframe.frontend.loader import RegressionCheckLoader
 import unittests.fixtures as fixtures
-from unittests.resources.checks.hellocheck import HelloTest
-from unittests.resources.checks.frontend_checks import (
-    BadSetupCheck,
-    BadSetupCheckEarly,
-    KeyboardInterruptCheck,
-    RetriesCheck,
-    SleepCheck,
-    SleepCheckPollFail,
-    SleepCheckPollFailLate,
-    SystemExitCheck,
+
+
+def _local_timeout(seconds):
+    '''Fail hung tests early instead of blocking the test session.
+
+    The limit applies only if all the partitions of the current system use a
+    local scheduler, since otherwise the test jobs may wait in a real batch
+    queue. This requires the pytest-timeout plugin.
+    '''
+    partitions = rt.runtime().system.partitions
+    if all(p.scheduler.is_local for p in partitions):
+        return pytest.mark.timeout(seconds, method='thread')
+
+    return pytest.mark.timeout(0)
+
+
+pytestmark = _local_timeout(30)
+
+# Scaling factor for the sleep times of the asynchronous policy tests; the
+# tests are dominated by these sleeps, so we keep them as short as possible
+_SLEEP_SCALE = float(os.getenv('RFM_TEST_SLEEP_SCALE', '0.1'))
+
+# Tolerance when checking whether tests have actually run concurrently
+_SLEEP_TOLERANCE = max(0.05, 0.1*_SLEEP_SCALE)
+
+
+@pytest.fixture(scope='session')
+def loaded_checks():
+    '''Load the test checks once per session.
+
+    The returned checks are shared among the tests, so any test that needs
+    to modify them must work on a copy.
+    '''
+    def load(*paths, **kwargs):
+        return RegressionCheckLoader(list(paths), **kwargs).load_all()
+
+    return {
+        'default': load('unittests/resources/checks', ignore_conflicts=True),
+        'deps_complex': load(
+            'unittests/resources/checks_unlisted/deps_complex.py'
+        ),
+        'deps_simple': load(
+            'unittests/resources/checks_unlisted/deps_simple.py'
+        )
+    }
+
+
+@pytest.fixture(scope='session')
+def deps_simple_graph(loaded_checks):
+    '''Build the test cases and the dependency graph of the ``deps_simple``
+    checks once per session.
+
+    Tests must not modify the returned cases; those that need to, must
+    generate their own.
+    '''
+    with rt.temp_runtime(fixtures.TEST_SITE_CONFIG, 'sys0'):
+        cases = executors.generate_testcases(loaded_checks['deps_simple'])
+        return cases, dependency.build_deps(cases)
+
+
+# Acyclic test graph used for validating and sorting dependencies; each entry
+# is a test name and the names of the tests it depends on.
+#
+#       t0       +-->t5<--+
+#       ^        |        |
+#       |        |        |
+#   +-->t1<--+   t6       t7
+#   |        |            ^
+#   t2<------t3           |
+#   ^        ^            |
+#   |        |            t8
+#   +---t4---+
+#
+_ACYCLIC_GRAPH = (
+    ('t0', ()),
+    ('t1', ('t0',)),
+    ('t2', ('t1',)),
+    ('t3', ('t1', 't2')),
+    ('t4', ('t2', 't3')),
+    ('t5', ()),
+    ('t6', ('t5',)),
+    ('t7', ('t5',)),
+    ('t8', ('t7',)),
 )
 
 
-class TestSerialExecutionPolicy(unittest.TestCase):
-    def setUp(self):
-        self.loader = RegressionCheckLoader(['unittests/resources/checks'],
-                                            ignore_conflicts=True)
+@pytest.fixture(scope='module')
+def build_deps_cached():
+    '''Return a function that builds the dependency graph of a test graph.
+
+    The test graph is described as in :data:`_ACYCLIC_GRAPH`. If a tuple of
+    test names is also passed, only the graph of these tests is built, using
+    the full graph to resolve their dependencies.
+
+    The function returns the test cases and their dependency graph and its
+    results are cached, so tests must not modify them.
+    '''
+    def _generate_testcases(graph, names=None):
+        tests = []
+        for name, deps in graph:
+            if names is not None and name not in names:
+                continue
+
+            t = TestDependencies.create_test(name)
+            for d in deps:
+                t.depends_on(d)
+
+            tests.append(t)
+
+        return executors.generate_testcases(tests)
+
+    @functools.lru_cache()
+    def _build_deps(graph, subgraph=None):
+        with rt.temp_runtime(fixtures.TEST_SITE_CONFIG, 'sys0'):
+            cases = _generate_testcases(graph, subgraph)
+            if subgraph is None:
+                return cases, dependency.build_deps(cases)
+
+            # Resolve the subgraph against a full graph of its own, since
+            # this updates the in-degree of the cases it depends on
+            full_deps = dependency.build_deps(_generate_testcases(graph))
+            return cases, dependency.build_deps(cases, full_deps)
+
+    return _build_deps
+
+
+class TestSerialExecutionPolicy:
+    @pytest.fixture(autouse=True)
+    def setup_runner(self, loaded_checks, tmp_path):
+        self.loaded_checks = loaded_checks
+        self.tmp_path = tmp_path
 
         # Setup the runner
         self.runner = executors.Runner(policies.SerialExecutionPolicy())
-        self.checks = self.loader.load_all()
+        self.checks = loaded_checks['default']
+
+        # The runtime does not change during these tests
+        self.runtime = rt.runtime()
 
         # Set runtime prefix
-        rt.runtime().resources.prefix = tempfile.mkdtemp(dir='unittests')
+        self.runtime.resources.prefix = str(tmp_path)
 
         # Reset current_run
-        rt.runtime()._current_run = 0
-
-    def tearDown(self):
-        os_ext.rmtree(rt.runtime().resources.prefix)
+        self.runtime._current_run = 0
 
     def runall(self, checks, sort=False, *args, **kwargs):
         cases = executors.generate_testcases(checks, *args, **kwargs)
@@ -65,7 +178,7 @@ class TestSerialExecutionPolicy(unittest.TestCase):
 
         self.runner.runall(cases)
 
-    def assertRunall(self):
+    def assert_runall(self):
         # Make sure that all cases finished or failed
         for t in self.runner.stats.tasks():
             assert t.succeeded or t.failed
@@ -75,21 +188,31 @@ class TestSerialExecutionPolicy(unittest.TestCase):
         return len([t for t in stats.failures() if t.failed_stage == stage])
 
     def assert_all_dead(self):
-        stats = self.runner.stats
-        for t in self.runner.stats.tasks():
+        def poll(task):
             try:
-                finished = t.check.poll()
+                return task.check.poll()
             except JobNotStartedError:
-                finished = True
+                return True
+
+        # Poll the tasks concurrently, since polling may need to query the
+        # scheduler for each job separately
+        tasks = self.runner.stats.tasks()
+        if not tasks:
+            return
+
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=len(tasks)) as executor:
+            finished = list(executor.map(poll, tasks))
 
-            assert finished
+        alive = [t.check.name for t, f in zip(tasks, finished) if not f]
+        assert not alive, 'jobs still running: %s' % alive
 
     def test_runall(self):
         self.runall(self.checks)
 
         stats = self.runner.stats
         assert 8 == stats.num_cases()
-        self.assertRunall()
+        self.assert_runall()
         assert 5 == len(stats.failures())
         assert 2 == self._num_failures_stage('setup')
         assert 1 == self._num_failures_stage('sanity')
@@ -101,7 +224,7 @@ class TestSerialExecutionPolicy(unittest.TestCase):
 
         stats = self.runner.stats
         assert 9 == stats.num_cases()
-        self.assertRunall()
+        self.assert_runall()
         assert 5 == len(stats.failures())
         assert 2 == self._num_failures_stage('setup')
         assert 1 == self._num_failures_stage('sanity')
@@ -113,7 +236,7 @@ class TestSerialExecutionPolicy(unittest.TestCase):
 
         stats = self.runner.stats
         assert 9 == stats.num_cases()
-        self.assertRunall()
+        self.assert_runall()
         assert 5 == len(stats.failures())
         assert 2 == self._num_failures_stage('setup')
         assert 1 == self._num_failures_stage('sanity')
@@ -126,7 +249,7 @@ class TestSerialExecutionPolicy(unittest.TestCase):
 
         stats = self.runner.stats
         assert 8 == stats.num_cases()
-        self.assertRunall()
+        self.assert_runall()
         assert 4 == len(stats.failures())
         assert 2 == self._num_failures_stage('setup')
         assert 0 == self._num_failures_stage('sanity')
@@ -139,7 +262,7 @@ class TestSerialExecutionPolicy(unittest.TestCase):
 
         stats = self.runner.stats
         assert 8 == stats.num_cases()
-        self.assertRunall()
+        self.assert_runall()
         assert 4 == len(stats.failures())
         assert 2 == self._num_failures_stage('setup')
         assert 1 == self._num_failures_stage('sanity')
@@ -152,7 +275,7 @@ class TestSerialExecutionPolicy(unittest.TestCase):
 
         stats = self.runner.stats
         assert 8 == stats.num_cases()
-        self.assertRunall()
+        self.assert_runall()
         assert 6 == len(stats.failures())
         assert 2 == self._num_failures_stage('setup')
         assert 1 == self._num_failures_stage('sanity')
@@ -160,14 +283,21 @@ class TestSerialExecutionPolicy(unittest.TestCase):
         assert 1 == self._num_failures_stage('cleanup')
 
     def test_force_local_execution(self):
+        from unittests.resources.checks.hellocheck import HelloTest
+
         self.runner.policy.force_local = True
         self.runall([HelloTest()])
-        self.assertRunall()
+        self.assert_runall()
         stats = self.runner.stats
         for t in stats.tasks():
             assert t.check.local
 
+    @pytest.mark.slow
     def test_kbd_interrupt_within_test(self):
+        from unittests.resources.checks.frontend_checks import (
+            KeyboardInterruptCheck
+        )
+
         check = KeyboardInterruptCheck()
         with pytest.raises(KeyboardInterrupt):
             self.runall([check])
@@ -177,6 +307,8 @@ class TestSerialExecutionPolicy(unittest.TestCase):
         self.assert_all_dead()
 
     def test_system_exit_within_test(self):
+        from unittests.resources.checks.frontend_checks import SystemExitCheck
+
         check = SystemExitCheck()
 
         # This should not raise and should not exit
@@ -185,6 +317,10 @@ class TestSerialExecutionPolicy(unittest.TestCase):
         assert 1 == len(stats.failures())
 
     def test_retries_bad_check(self):
+        from unittests.resources.checks.frontend_checks import (
+            BadSetupCheck, BadSetupCheckEarly
+        )
+
         max_retries = 2
         checks = [BadSetupCheck(), BadSetupCheckEarly()]
         self.runner._max_retries = max_retries
@@ -192,14 +328,16 @@ class TestSerialExecutionPolicy(unittest.TestCase):
 
         # Ensure that the test was retried #max_retries times and failed.
         assert 2 == self.runner.stats.num_cases()
-        self.assertRunall()
-        assert max_retries == rt.runtime().current_run
+        self.assert_runall()
+        assert max_retries == self.runtime.current_run
         assert 2 == len(self.runner.stats.failures())
 
         # Ensure that the report does not raise any exception.
         self.runner.stats.retry_report()
 
     def test_retries_good_check(self):
+        from unittests.resources.checks.hellocheck import HelloTest
+
         max_retries = 2
         checks = [HelloTest()]
         self.runner._max_retries = max_retries
@@ -207,40 +345,37 @@ class TestSerialExecutionPolicy(unittest.TestCase):
 
         # Ensure that the test passed without retries.
         assert 1 == self.runner.stats.num_cases()
-        self.assertRunall()
-        assert 0 == rt.runtime().current_run
+        self.assert_runall()
+        assert 0 == self.runtime.current_run
         assert 0 == len(self.runner.stats.failures())
 
     def test_pass_in_retries(self):
+        from unittests.resources.checks.frontend_checks import RetriesCheck
+
         max_retries = 3
         run_to_pass = 2
         # Create a file containing the current_run; Run 0 will set it to 0,
         # run 1 to 1 and so on.
-        with tempfile.NamedTemporaryFile(mode='wt', delete=False) as fp:
-            fp.write('0\n')
+        retries_file = self.tmp_path / 'retries.txt'
+        retries_file.write_text('0\n')
 
-        checks = [RetriesCheck(run_to_pass, fp.name)]
+        checks = [RetriesCheck(run_to_pass, str(retries_file))]
         self.runner._max_retries = max_retries
         self.runall(checks)
 
         # Ensure that the test passed after retries in run #run_to_pass.
         assert 1 == self.runner.stats.num_cases()
-        self.assertRunall()
+        self.assert_runall()
         assert 1 == len(self.runner.stats.failures(run=0))
-        assert run_to_pass == rt.runtime().current_run
+        assert run_to_pass == self.runtime.current_run
         assert 0 == len(self.runner.stats.failures())
-        os.remove(fp.name)
 
-    def test_dependencies(self):
-        self.loader = RegressionCheckLoader(
-            ['unittests/resources/checks_unlisted/deps_complex.py']
-        )
-
-        # Setup the runner
-        self.checks = self.loader.load_all()
-        self.runall(self.checks, sort=True)
+    @pytest.mark.parametrize('max_retries', [0, 2])
+    def test_dependencies(self, max_retries):
+        self.runner._max_retries = max_retries
+        self.runall(self.loaded_checks['deps_complex'], sort=True)
 
-        self.assertRunall()
+        self.assert_runall()
         stats = self.runner.stats
         assert stats.num_cases(0) == 10
         assert len(stats.failures()) == 4
@@ -259,11 +394,11 @@ class TestSerialExecutionPolicy(unittest.TestCase):
             if t.ref_count == 0:
                 assert os.path.exists(os.path.join(check.outputdir, 'out.txt'))
 
+    @pytest.mark.slow
     def test_sigterm(self):
-        self.loader = RegressionCheckLoader(
+        checks = RegressionCheckLoader(
             ['unittests/resources/checks_unlisted/selfkill.py']
-        )
-        checks = self.loader.load_all()
+        ).load_all()
         with pytest.raises(ReframeForceExitError,
                            match='received TERM signal'):
             self.runall(checks)
@@ -272,10 +407,6 @@ class TestSerialExecutionPolicy(unittest.TestCase):
         assert self.runner.stats.num_cases() == 1
         assert len(self.runner.stats.failures()) == 1
 
-    def test_dependencies_with_retries(self):
-        self.runner._max_retries = 2
-        self.test_dependencies()
-
 
 class TaskEventMonitor(executors.TaskEventListener):
     '''Event listener for monitoring the execution of the asynchronous
@@ -319,15 +450,15 @@ class TaskEventMonitor(executors.TaskEventListener):
 
 
 class TestAsynchronousExecutionPolicy(TestSerialExecutionPolicy):
-    def setUp(self):
-        super().setUp()
+    @pytest.fixture(autouse=True)
+    def setup_async_runner(self, setup_runner):
         self.runner = executors.Runner(policies.AsynchronousExecutionPolicy())
         self.runner.policy.keep_stage_files = True
         self.monitor = TaskEventMonitor()
         self.runner.policy.task_listeners.append(self.monitor)
 
     def set_max_jobs(self, value):
-        for p in rt.runtime().system.partitions:
+        for p in self.runtime.system.partitions:
             p._max_jobs = value
 
     def read_timestamps(self, tasks):
@@ -338,22 +469,51 @@ class TestAsynchronousExecutionPolicy(TestSerialExecutionPolicy):
         self.begin_stamps = []
         self.end_stamps = []
         for t in tasks:
-            with os_ext.change_dir(t.check.stagedir):
-                with open(evaluate(t.check.stdout), 'r') as f:
-                    self.begin_stamps.append(float(f.readline().strip()))
-                    self.end_stamps.append(float(f.readline().strip()))
+            # The timestamps are the first two lines of the standard output,
+            # so we only need to read its first few bytes
+            stdout = os.path.join(t.check.stagedir, evaluate(t.check.stdout))
+            fd = os.open(stdout, os.O_RDONLY)
+            try:
+                data = os.read(fd, 128)
+            finally:
+                os.close(fd)
+
+            begin, end, *_ = data.split(b'\n')
+            self.begin_stamps.append(float(begin))
+            self.end_stamps.append(float(end))
 
         self.begin_stamps.sort()
         self.end_stamps.sort()
 
+    def assert_begin_after_end(self, num_jobs):
+        '''Assert that every job after the first ``num_jobs`` started after
+        one of the previous ``num_jobs`` jobs had finished.
+
+        The timestamps must have been read with :func:`read_timestamps`.
+        '''
+        violations = [
+            i for i, (b, e) in enumerate(zip(self.begin_stamps[num_jobs:],
+                                             self.end_stamps[:-num_jobs]),
+                                         start=num_jobs)
+            if b <= e
+        ]
+        assert not violations, (
+            'jobs started before a previous job had finished: %s '
+            '(begin: %s, end: %s)' % (violations, self.begin_stamps,
+                                      self.end_stamps)
+        )
+
+    @pytest.mark.slow
     def test_concurrency_unlimited(self):
-        checks = [SleepCheck(0.5) for i in range(3)]
+        from unittests.resources.checks.frontend_checks import SleepCheck
+
+        checks = [SleepCheck(0.5*_SLEEP_SCALE) for i in range(3)]
         self.set_max_jobs(len(checks))
         self.runall(checks)
 
         # Ensure that all tests were run and without failures.
         assert len(checks) == self.runner.stats.num_cases()
-        self.assertRunall()
+        self.assert_runall()
         assert 0 == len(self.runner.stats.failures())
 
         # Ensure that maximum concurrency was reached as fast as possible
@@ -365,21 +525,24 @@ class TestAsynchronousExecutionPolicy(TestSerialExecutionPolicy):
         # Warn if not all tests were run in parallel; the corresponding strict
         # check would be:
         #
-        #     self.assertTrue(self.begin_stamps[-1] <= self.end_stamps[0])
+        #     assert self.begin_stamps[-1] <= self.end_stamps[0]
         #
-        if self.begin_stamps[-1] > self.end_stamps[0]:
+        if self.begin_stamps[-1] > self.end_stamps[0] + _SLEEP_TOLERANCE:
             pytest.skip('the system seems too much loaded.')
 
+    @pytest.mark.slow
     def test_concurrency_limited(self):
+        from unittests.resources.checks.frontend_checks import SleepCheck
+
         # The number of checks must be <= 2*max_jobs.
-        checks = [SleepCheck(0.5) for i in range(5)]
+        checks = [SleepCheck(0.5*_SLEEP_SCALE) for i in range(5)]
         max_jobs = len(checks) - 2
         self.set_max_jobs(max_jobs)
         self.runall(checks)
 
         # Ensure that all tests were run and without failures.
         assert len(checks) == self.runner.stats.num_cases()
-        self.assertRunall()
+        self.assert_runall()
         assert 0 == len(self.runner.stats.failures())
 
         # Ensure that maximum concurrency was reached as fast as possible
@@ -392,9 +555,7 @@ class TestAsynchronousExecutionPolicy(TestSerialExecutionPolicy):
         # one of the previous #max_jobs jobs had finished
         # (e.g. begin[max_jobs] > end[0]).
         # Note: we may ensure this strictly as we may ensure serial behaviour.
-        begin_after_end = (b > e for b, e in zip(self.begin_stamps[max_jobs:],
-                                                 self.end_stamps[:-max_jobs]))
-        assert all(begin_after_end)
+        self.assert_begin_after_end(max_jobs)
 
         # NOTE: to ensure that these remaining jobs were also run
         # in parallel one could do the command hereafter; however, it would
@@ -406,19 +567,23 @@ class TestAsynchronousExecutionPolicy(TestSerialExecutionPolicy):
 
         # Warn if the first #max_jobs jobs were not run in parallel; the
         # corresponding strict check would be:
-        # self.assertTrue(self.begin_stamps[max_jobs-1] <= self.end_stamps[0])
-        if self.begin_stamps[max_jobs-1] > self.end_stamps[0]:
+        # assert self.begin_stamps[max_jobs-1] <= self.end_stamps[0]
+        if (self.begin_stamps[max_jobs-1] >
+            self.end_stamps[0] + _SLEEP_TOLERANCE):
             pytest.skip('the system seems too loaded.')
 
+    @pytest.mark.slow
     def test_concurrency_none(self):
-        checks = [SleepCheck(0.5) for i in range(3)]
+        from unittests.resources.checks.frontend_checks import SleepCheck
+
+        checks = [SleepCheck(0.5*_SLEEP_SCALE) for i in range(3)]
         num_checks = len(checks)
         self.set_max_jobs(1)
         self.runall(checks)
 
         # Ensure that all tests were run and without failures.
         assert len(checks) == self.runner.stats.num_cases()
-        self.assertRunall()
+        self.assert_runall()
         assert 0 == len(self.runner.stats.failures())
 
         # Ensure that a single task was running all the time
@@ -429,9 +594,7 @@ class TestAsynchronousExecutionPolicy(TestSerialExecutionPolicy):
 
         # Ensure that the jobs were run after the previous job had finished
         # (e.g. begin[1] > end[0]).
-        begin_after_end = (b > e for b, e in zip(self.begin_stamps[1:],
-                                                 self.end_stamps[:-1]))
-        assert all(begin_after_end)
+        self.assert_begin_after_end(1)
 
     def _run_checks(self, checks, max_jobs):
         self.set_max_jobs(max_jobs)
@@ -439,16 +602,31 @@ class TestAsynchronousExecutionPolicy(TestSerialExecutionPolicy):
             self.runall(checks)
 
         assert 4 == self.runner.stats.num_cases()
-        self.assertRunall()
+        self.assert_runall()
         assert 4 == len(self.runner.stats.failures())
         self.assert_all_dead()
 
+    @_local_timeout(60)
+    @pytest.mark.slow
     def test_kbd_interrupt_in_wait_with_concurrency(self):
+        from unittests.resources.checks.frontend_checks import (
+            KeyboardInterruptCheck, SleepCheck
+        )
+
+        # The sleep checks are killed as soon as the KeyboardInterruptCheck
+        # finishes, so their sleep times are not scaled; they only need to
+        # outlive it.
         checks = [KeyboardInterruptCheck(),
                   SleepCheck(10), SleepCheck(10), SleepCheck(10)]
         self._run_checks(checks, 4)
 
+    @_local_timeout(60)
+    @pytest.mark.slow
     def test_kbd_interrupt_in_wait_with_limited_concurrency(self):
+        from unittests.resources.checks.frontend_checks import (
+            KeyboardInterruptCheck, SleepCheck
+        )
+
         # The general idea for this test is to allow enough time for all the
         # four checks to be submitted and at the same time we need the
         # KeyboardInterruptCheck to finish first (the corresponding wait should
@@ -458,40 +636,62 @@ class TestAsynchronousExecutionPolicy(TestSerialExecutionPolicy):
                   SleepCheck(10), SleepCheck(10), SleepCheck(10)]
         self._run_checks(checks, 2)
 
+    @pytest.mark.slow
     def test_kbd_interrupt_in_setup_with_concurrency(self):
+        from unittests.resources.checks.frontend_checks import (
+            KeyboardInterruptCheck, SleepCheck
+        )
+
         checks = [SleepCheck(1), SleepCheck(1), SleepCheck(1),
                   KeyboardInterruptCheck(phase='setup')]
         self._run_checks(checks, 4)
 
+    @pytest.mark.slow
     def test_kbd_interrupt_in_setup_with_limited_concurrency(self):
+        from unittests.resources.checks.frontend_checks import (
+            KeyboardInterruptCheck, SleepCheck
+        )
+
         checks = [SleepCheck(1), SleepCheck(1), SleepCheck(1),
                   KeyboardInterruptCheck(phase='setup')]
         self._run_checks(checks, 2)
 
+    @pytest.mark.slow
     def test_poll_fails_main_loop(self):
+        from unittests.resources.checks.frontend_checks import (
+            SleepCheckPollFail
+        )
+
         num_tasks = 3
-        checks = [SleepCheckPollFail(10) for i in range(num_tasks)]
+        checks = [SleepCheckPollFail(10*_SLEEP_SCALE)
+                  for i in range(num_tasks)]
         num_checks = len(checks)
         self.set_max_jobs(1)
         self.runall(checks)
         stats = self.runner.stats
         assert num_tasks == stats.num_cases()
-        self.assertRunall()
+        self.assert_runall()
         assert num_tasks == len(stats.failures())
 
+    @pytest.mark.slow
     def test_poll_fails_busy_loop(self):
+        from unittests.resources.checks.frontend_checks import (
+            SleepCheckPollFailLate
+        )
+
         num_tasks = 3
-        checks = [SleepCheckPollFailLate(1/i) for i in range(1, num_tasks+1)]
+        checks = [SleepCheckPollFailLate(_SLEEP_SCALE/i)
+                  for i in range(1, num_tasks+1)]
         num_checks = len(checks)
         self.set_max_jobs(1)
         self.runall(checks)
         stats = self.runner.stats
         assert num_tasks == stats.num_cases()
-        self.assertRunall()
+        self.assert_runall()
         assert num_tasks == len(stats.failures())
 
 
-class TestDependencies(unittest.TestCase):
+class TestDependencies:
     class Node:
         '''A node in the test case graph.
 
@@ -517,53 +717,61 @@ class TestDependencies(unittest.TestCase):
             return NotImplemented
 
         def __hash__(self):
-            return hash(self.cname) ^ hash(self.pname) ^ hash(self.ename)
+            # Must match the hash of the corresponding test case
+            return hash((self.cname, self.pname, self.ename))
 
         def __repr__(self):
             return 'Node(%r, %r, %r)' % (self.cname, self.pname, self.ename)
 
-    def has_edge(graph, src, dst):
-        return dst in graph[src]
+    def index_deps(graph):
+        '''Index the graph nodes and their dependencies by test name.'''
+        ret = collections.defaultdict(list)
+        for c, deps in graph.items():
+            ret[c.check.name].append((c, deps))
+
+        return ret
 
-    def num_deps(graph, cname):
-        return sum(len(deps) for c, deps in graph.items()
-                   if c.check.name == cname)
+    def edges(index, cname):
+        '''Return the set of dependency edges of test ``cname``.'''
+        return {(c, d) for c, deps in index[cname] for d in deps}
 
-    def in_degree(graph, node):
-        for v in graph.keys():
+    def num_deps(index, cname):
+        return sum(len(deps) for c, deps in index[cname])
+
+    def in_degree(index, node):
+        for v, _ in index[node.cname]:
             if v == node:
                 return v.num_dependents
 
-    def find_check(name, checks):
-        for c in checks:
-            if c.name == name:
-                return c
+    def index_checks(checks):
+        return {c.name: c for c in checks}
 
-        return None
+    def index_cases(cases):
+        '''Index test cases by test and environment name.
 
-    def find_case(cname, ename, cases):
+        If there are multiple cases for the same test and environment, the
+        first one is kept.
+        '''
+        ret = {}
         for c in cases:
-            if c.check.name == cname and c.environ.name == ename:
-                return c
+            ret.setdefault((c.check.name, c.environ.name), c)
 
-    def setUp(self):
-        self.loader = RegressionCheckLoader([
-            'unittests/resources/checks_unlisted/deps_simple.py'
-        ])
+        return ret
 
-        # Set runtime prefix
-        rt.runtime().resources.prefix = tempfile.mkdtemp(dir='unittests')
+    @pytest.fixture(autouse=True)
+    def setup_checks(self, loaded_checks, deps_simple_graph, tmp_path):
+        self.checks = loaded_checks['deps_simple']
+        self.cases, self.deps = deps_simple_graph
+        self.checks_by_name = TestDependencies.index_checks(self.checks)
+        self.cases_by_key = TestDependencies.index_cases(self.cases)
 
-    def tearDown(self):
-        os_ext.rmtree(rt.runtime().resources.prefix)
+        # Set runtime prefix
+        rt.runtime().resources.prefix = str(tmp_path)
 
     @rt.switch_runtime(fixtures.TEST_SITE_CONFIG, 'sys0')
     def test_eq_hash(self):
-        find_case = TestDependencies.find_case
-        cases = executors.generate_testcases(self.loader.load_all())
-
-        case0 = find_case('Test0', 'e0', cases)
-        case1 = find_case('Test0', 'e1', cases)
+        case0 = self.cases_by_key['Test0', 'e0']
+        case1 = self.cases_by_key['Test0', 'e1']
         case0_copy = case0.clone()
 
         assert case0 == case0_copy
@@ -572,59 +780,48 @@ class TestDependencies(unittest.TestCase):
         assert hash(case1) != hash(case0)
 
     @rt.switch_runtime(fixtures.TEST_SITE_CONFIG, 'sys0')
-    def test_build_deps(self):
+    def test_build_deps(self, monkeypatch):
         Node = TestDependencies.Node
-        has_edge = TestDependencies.has_edge
+        index_deps = TestDependencies.index_deps
+        edges = TestDependencies.edges
         num_deps = TestDependencies.num_deps
         in_degree = TestDependencies.in_degree
-        find_check = TestDependencies.find_check
-        find_case = TestDependencies.find_case
-
-        checks = self.loader.load_all()
-        cases = executors.generate_testcases(checks)
+        deps = self.deps
+        partitions = ['sys0:p0', 'sys0:p1']
+        environs = ['e0', 'e1']
 
-        # Test calling getdep() before having built the graph
-        t = find_check('Test1_exact', checks)
+        # Test calling getdep() on a check outside the graph
+        t = self.checks_by_name['Test1_exact']
         with pytest.raises(DependencyError):
             t.getdep('Test0', 'e0')
 
-        # Build dependencies and continue testing
-        deps = dependency.build_deps(cases)
+        # Validate the dependencies and continue testing
         dependency.validate_deps(deps)
+        deps_index = index_deps(deps)
 
         # Check DEPEND_FULLY dependencies
-        assert num_deps(deps, 'Test1_fully') == 8
-        for p in ['sys0:p0', 'sys0:p1']:
-            for e0 in ['e0', 'e1']:
-                for e1 in ['e0', 'e1']:
-                    assert has_edge(deps,
-                                    Node('Test1_fully', p, e0),
-                                    Node('Test0', p, e1))
+        assert num_deps(deps_index, 'Test1_fully') == 8
+        assert edges(deps_index, 'Test1_fully') == {
+            (Node('Test1_fully', p, e0), Node('Test0', p, e1))
+            for p in partitions for e0 in environs for e1 in environs
+        }
 
         # Check DEPEND_BY_ENV
-        assert num_deps(deps, 'Test1_by_env') == 4
-        assert num_deps(deps, 'Test1_default') == 4
-        for p in ['sys0:p0', 'sys0:p1']:
-            for e in ['e0', 'e1']:
-                assert has_edge(deps,
-                                Node('Test1_by_env', p, e),
-                                Node('Test0', p, e))
-                assert has_edge(deps,
-                                Node('Test1_default', p, e),
-                                Node('Test0', p, e))
+        assert num_deps(deps_index, 'Test1_by_env') == 4
+        assert num_deps(deps_index, 'Test1_default') == 4
+        for cname in ['Test1_by_env', 'Test1_default']:
+            assert edges(deps_index, cname) == {
+                (Node(cname, p, e), Node('Test0', p, e))
+                for p in partitions for e in environs
+            }
 
         # Check DEPEND_EXACT
-        assert num_deps(deps, 'Test1_exact') == 6
-        for p in ['sys0:p0', 'sys0:p1']:
-            assert has_edge(deps,
-                            Node('Test1_exact', p, 'e0'),
-                            Node('Test0', p, 'e0'))
-            assert has_edge(deps,
-                            Node('Test1_exact', p, 'e0'),
-                            Node('Test0', p, 'e1'))
-            assert has_edge(deps,
-                            Node('Test1_exact', p, 'e1'),
-                            Node('Test0', p, 'e1'))
+        assert num_deps(deps_index, 'Test1_exact') == 6
+        assert edges(deps_index, 'Test1_exact') == {
+            (Node('Test1_exact', p, e0), Node('Test0', p, e1))
+            for p in partitions
+            for e0, e1 in [('e0', 'e0'), ('e0', 'e1'), ('e1', 'e1')]
+        }
 
         # Check in-degree of Test0
 
@@ -632,26 +829,27 @@ class TestDependencies(unittest.TestCase):
         # 1 from Test1_by_env,
         # 1 from Test1_exact,
         # 1 from Test1_default
-        assert in_degree(deps, Node('Test0', 'sys0:p0', 'e0')) == 5
-        assert in_degree(deps, Node('Test0', 'sys0:p1', 'e0')) == 5
+        assert in_degree(deps_index, Node('Test0', 'sys0:p0', 'e0')) == 5
+        assert in_degree(deps_index, Node('Test0', 'sys0:p1', 'e0')) == 5
 
         # 2 from Test1_fully,
         # 1 from Test1_by_env,
         # 2 from Test1_exact,
         # 1 from Test1_default
-        assert in_degree(deps, Node('Test0', 'sys0:p0', 'e1')) == 6
-        assert in_degree(deps, Node('Test0', 'sys0:p1', 'e1')) == 6
+        assert in_degree(deps_index, Node('Test0', 'sys0:p0', 'e1')) == 6
+        assert in_degree(deps_index, Node('Test0', 'sys0:p1', 'e1')) == 6
 
         # Pick a check to test getdep()
-        check_e0 = find_case('Test1_exact', 'e0', cases).check
-        check_e1 = find_case('Test1_exact', 'e1', cases).check
+        check_e0 = self.cases_by_key['Test1_exact', 'e0'].check
+        check_e1 = self.cases_by_key['Test1_exact', 'e1'].check
 
         with pytest.raises(DependencyError):
             check_e0.getdep('Test0')
 
-        # Set the current environment
-        check_e0._current_environ = Environment('e0')
-        check_e1._current_environ = Environment('e1')
+        # Set the current environment; the cases are shared, so we make sure
+        # to restore it at the end of the test
+        monkeypatch.setattr(check_e0, '_current_environ', Environment('e0'))
+        monkeypatch.setattr(check_e1, '_current_environ', Environment('e1'))
 
         assert check_e0.getdep('Test0', 'e0').name == 'Test0'
         assert check_e0.getdep('Test0', 'e1').name == 'Test0'
@@ -667,13 +865,13 @@ class TestDependencies(unittest.TestCase):
 
     @rt.switch_runtime(fixtures.TEST_SITE_CONFIG, 'sys0')
     def test_build_deps_unknown_test(self):
-        find_check = TestDependencies.find_check
-        checks = self.loader.load_all()
+        checks = copy.deepcopy(self.checks)
+        checks_by_name = TestDependencies.index_checks(checks)
 
         # Add some inexistent dependencies
-        test0 = find_check('Test0', checks)
+        test0 = checks_by_name['Test0']
         for depkind in ('default', 'fully', 'by_env', 'exact'):
-            test1 = find_check('Test1_' + depkind, checks)
+            test1 = checks_by_name['Test1_' + depkind]
             if depkind == 'default':
                 test1.depends_on('TestX')
             elif depkind == 'exact':
@@ -688,37 +886,39 @@ class TestDependencies(unittest.TestCase):
 
     @rt.switch_runtime(fixtures.TEST_SITE_CONFIG, 'sys0')
     def test_build_deps_unknown_target_env(self):
-        find_check = TestDependencies.find_check
-        checks = self.loader.load_all()
+        checks = copy.deepcopy(self.checks)
+        checks_by_name = TestDependencies.index_checks(checks)
 
         # Add some inexistent dependencies
-        test0 = find_check('Test0', checks)
-        test1 = find_check('Test1_default', checks)
+        test0 = checks_by_name['Test0']
+        test1 = checks_by_name['Test1_default']
         test1.depends_on('Test0', rfm.DEPEND_EXACT, {'e0': ['eX']})
         with pytest.raises(DependencyError):
             dependency.build_deps(executors.generate_testcases(checks))
 
     @rt.switch_runtime(fixtures.TEST_SITE_CONFIG, 'sys0')
     def test_build_deps_unknown_source_env(self):
-        find_check = TestDependencies.find_check
+        index_deps = TestDependencies.index_deps
         num_deps = TestDependencies.num_deps
-        checks = self.loader.load_all()
+        checks = copy.deepcopy(self.checks)
+        checks_by_name = TestDependencies.index_checks(checks)
 
         # Add some inexistent dependencies
-        test0 = find_check('Test0', checks)
-        test1 = find_check('Test1_default', checks)
+        test0 = checks_by_name['Test0']
+        test1 = checks_by_name['Test1_default']
         test1.depends_on('Test0', rfm.DEPEND_EXACT, {'eX': ['e0']})
 
         # Unknown source is ignored, because it might simply be that the test
         # is not executed for eX
         deps = dependency.build_deps(executors.generate_testcases(checks))
-        assert num_deps(deps, 'Test1_default') == 4
+        assert num_deps(index_deps(deps), 'Test1_default') == 4
 
     @rt.switch_runtime(fixtures.TEST_SITE_CONFIG, 'sys0')
     def test_build_deps_empty(self):
         assert {} == dependency.build_deps([])
 
-    def create_test(self, name):
+    @staticmethod
+    def create_test(name):
         test = rfm.RegressionTest()
         test.name = name
         test.valid_systems = ['*']
@@ -728,45 +928,12 @@ class TestDependencies(unittest.TestCase):
         return test
 
     @rt.switch_runtime(fixtures.TEST_SITE_CONFIG, 'sys0')
-    def test_valid_deps(self):
-        #
-        #       t0       +-->t5<--+
-        #       ^        |        |
-        #       |        |        |
-        #   +-->t1<--+   t6       t7
-        #   |        |            ^
-        #   t2<------t3           |
-        #   ^        ^            |
-        #   |        |            t8
-        #   +---t4---+
-        #
-        t0 = self.create_test('t0')
-        t1 = self.create_test('t1')
-        t2 = self.create_test('t2')
-        t3 = self.create_test('t3')
-        t4 = self.create_test('t4')
-        t5 = self.create_test('t5')
-        t6 = self.create_test('t6')
-        t7 = self.create_test('t7')
-        t8 = self.create_test('t8')
-        t1.depends_on('t0')
-        t2.depends_on('t1')
-        t3.depends_on('t1')
-        t3.depends_on('t2')
-        t4.depends_on('t2')
-        t4.depends_on('t3')
-        t6.depends_on('t5')
-        t7.depends_on('t5')
-        t8.depends_on('t7')
-        dependency.validate_deps(
-            dependency.build_deps(
-                executors.generate_testcases([t0, t1, t2, t3, t4,
-                                              t5, t6, t7, t8])
-            )
-        )
+    def test_valid_deps(self, build_deps_cached):
+        _, deps = build_deps_cached(_ACYCLIC_GRAPH)
+        dependency.validate_deps(deps)
 
     @rt.switch_runtime(fixtures.TEST_SITE_CONFIG, 'sys0')
-    def test_cyclic_deps(self):
+    def test_cyclic_deps(self, build_deps_cached):
         #
         #       t0       +-->t5<--+
         #       ^        |        |
@@ -778,38 +945,26 @@ class TestDependencies(unittest.TestCase):
         #   |   v    |            t8
         #   +---t4---+
         #
-        t0 = self.create_test('t0')
-        t1 = self.create_test('t1')
-        t2 = self.create_test('t2')
-        t3 = self.create_test('t3')
-        t4 = self.create_test('t4')
-        t5 = self.create_test('t5')
-        t6 = self.create_test('t6')
-        t7 = self.create_test('t7')
-        t8 = self.create_test('t8')
-        t1.depends_on('t0')
-        t1.depends_on('t4')
-        t2.depends_on('t1')
-        t3.depends_on('t1')
-        t4.depends_on('t2')
-        t4.depends_on('t3')
-        t6.depends_on('t5')
-        t7.depends_on('t5')
-        t8.depends_on('t7')
-        deps = dependency.build_deps(
-            executors.generate_testcases([t0, t1, t2, t3, t4,
-                                          t5, t6, t7, t8])
-        )
-
+        _, deps = build_deps_cached((
+            ('t0', ()),
+            ('t1', ('t0', 't4')),
+            ('t2', ('t1',)),
+            ('t3', ('t1',)),
+            ('t4', ('t2', 't3')),
+            ('t5', ()),
+            ('t6', ('t5',)),
+            ('t7', ('t5',)),
+            ('t8', ('t7',)),
+        ))
         with pytest.raises(DependencyError) as exc_info:
             dependency.validate_deps(deps)
 
-        assert ('t4->t2->t1->t4' in str(exc_info.value) or
-                't2->t1->t4->t2' in str(exc_info.value) or
-                't1->t4->t2->t1' in str(exc_info.value) or
-                't1->t4->t3->t1' in str(exc_info.value) or
-                't4->t3->t1->t4' in str(exc_info.value) or
-                't3->t1->t4->t3' in str(exc_info.value))
+        assert exc_info.value.cycle in {('t4', 't2', 't1', 't4'),
+                                        ('t2', 't1', 't4', 't2'),
+                                        ('t1', 't4', 't2', 't1'),
+                                        ('t1', 't4', 't3', 't1'),
+                                        ('t4', 't3', 't1', 't4'),
+                                        ('t3', 't1', 't4', 't3')}
 
     @rt.switch_runtime(fixtures.TEST_SITE_CONFIG, 'sys0')
     def test_cyclic_deps_by_env(self):
@@ -823,8 +978,26 @@ class TestDependencies(unittest.TestCase):
         with pytest.raises(DependencyError) as exc_info:
             dependency.validate_deps(deps)
 
-        assert ('t1->t0->t1' in str(exc_info.value) or
-                't0->t1->t0' in str(exc_info.value))
+        assert exc_info.value.cycle in {('t1', 't0', 't1'),
+                                        ('t0', 't1', 't0')}
+
+    @rt.switch_runtime(fixtures.TEST_SITE_CONFIG, 'sys0')
+    def test_cyclic_deps_reachable(self):
+        # t2 is not part of the cycle, but it can reach it
+        t0 = self.create_test('t0')
+        t1 = self.create_test('t1')
+        t2 = self.create_test('t2')
+        t0.depends_on('t1')
+        t1.depends_on('t0')
+        t2.depends_on('t0')
+        deps = dependency.build_deps(
+            executors.generate_testcases([t0, t1, t2])
+        )
+        with pytest.raises(DependencyError) as exc_info:
+            dependency.validate_deps(deps)
+
+        assert exc_info.value.cycle in {('t1', 't0', 't1'),
+                                        ('t0', 't1', 't0')}
 
     @rt.switch_runtime(fixtures.TEST_SITE_CONFIG, 'sys0')
     def test_validate_deps_empty(self):
@@ -832,104 +1005,42 @@ class TestDependencies(unittest.TestCase):
 
     def assert_topological_order(self, cases, graph):
         cases_order = []
-        visited_tests = set()
-        tests = util.OrderedSet()
-        for c in cases:
+        order_index = {c: i for i, c in enumerate(cases)}
+
+        # Visited tests in order of appearance
+        tests = {}
+        for i, c in enumerate(cases):
             check, part, env = c
             cases_order.append((check.name, part.fullname, env.name))
-            tests.add(check.name)
-            visited_tests.add(check.name)
+            tests.setdefault(check.name, None)
 
-            # Assert that all dependencies of c have been visited before
+            # Assert that all dependencies of c come before it
             for d in graph[c]:
-                if d not in cases:
-                    # dependency points outside the subgraph
-                    continue
-
-                assert d.check.name in visited_tests
-
-        # Check the order of systems and prog. environments
-        # We are checking against all possible orderings
-        valid_orderings = []
-        for partitions in itertools.permutations(['sys0:p0', 'sys0:p1']):
-            for environs in itertools.permutations(['e0', 'e1']):
-                ordering = []
-                for t in tests:
-                    for p in partitions:
-                        for e in environs:
-                            ordering.append((t, p, e))
-
-                valid_orderings.append(ordering)
-
-        assert cases_order in valid_orderings
+                # Dependencies outside the subgraph have no position
+                assert order_index.get(d, -1) < i
+
+        # Check that the cases of each test are contiguous and that they
+        # follow the order of systems and prog. environments in the graph
+        partitions = ['sys0:p0', 'sys0:p1']
+        environs = ['e0', 'e1']
+        group_order = list(itertools.product(partitions, environs))
+        group_size = len(group_order)
+        assert len(cases_order) == group_size * len(tests)
+        for t, i in zip(tests, range(0, len(cases_order), group_size)):
+            group = cases_order[i:i+group_size]
+            assert {c[0] for c in group} == {t}
+            assert [(c[1], c[2]) for c in group] == group_order
 
     @rt.switch_runtime(fixtures.TEST_SITE_CONFIG, 'sys0')
-    def test_toposort(self):
-        #
-        #       t0       +-->t5<--+
-        #       ^        |        |
-        #       |        |        |
-        #   +-->t1<--+   t6       t7
-        #   |        |            ^
-        #   t2<------t3           |
-        #   ^        ^            |
-        #   |        |            t8
-        #   +---t4---+
-        #
-        t0 = self.create_test('t0')
-        t1 = self.create_test('t1')
-        t2 = self.create_test('t2')
-        t3 = self.create_test('t3')
-        t4 = self.create_test('t4')
-        t5 = self.create_test('t5')
-        t6 = self.create_test('t6')
-        t7 = self.create_test('t7')
-        t8 = self.create_test('t8')
-        t1.depends_on('t0')
-        t2.depends_on('t1')
-        t3.depends_on('t1')
-        t3.depends_on('t2')
-        t4.depends_on('t2')
-        t4.depends_on('t3')
-        t6.depends_on('t5')
-        t7.depends_on('t5')
-        t8.depends_on('t7')
-        deps = dependency.build_deps(
-            executors.generate_testcases([t0, t1, t2, t3, t4,
-                                          t5, t6, t7, t8])
-        )
+    def test_toposort(self, build_deps_cached):
+        _, deps = build_deps_cached(_ACYCLIC_GRAPH)
         cases = dependency.toposort(deps)
         self.assert_topological_order(cases, deps)
 
     @rt.switch_runtime(fixtures.TEST_SITE_CONFIG, 'sys0')
-    def test_toposort_subgraph(self):
-        #
-        #       t0
-        #       ^
-        #       |
-        #   +-->t1<--+
-        #   |        |
-        #   t2<------t3
-        #   ^        ^
-        #   |        |
-        #   +---t4---+
-        #
-        t0 = self.create_test('t0')
-        t1 = self.create_test('t1')
-        t2 = self.create_test('t2')
-        t3 = self.create_test('t3')
-        t4 = self.create_test('t4')
-        t1.depends_on('t0')
-        t2.depends_on('t1')
-        t3.depends_on('t1')
-        t3.depends_on('t2')
-        t4.depends_on('t2')
-        t4.depends_on('t3')
-        full_deps = dependency.build_deps(
-            executors.generate_testcases([t0, t1, t2, t3, t4])
-        )
-        partial_deps = dependency.build_deps(
-            executors.generate_testcases([t3, t4]), full_deps
-        )
+    def test_toposort_subgraph(self, build_deps_cached):
+        # Sort only the cases of t3 and t4; their dependencies on t1 and t2
+        # point outside the subgraph
+        _, partial_deps = build_deps_cached(_ACYCLIC_GRAPH, ('t3', 't4'))
         cases = dependency.toposort(partial_deps, is_subgraph=True)
         self.assert_topological_order(cases, partial_deps)